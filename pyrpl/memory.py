@@ -17,11 +17,17 @@
 ###############################################################################
 
 import os
+import io
+import sys
+import copy
+import json
+import base64
+import hashlib
 from collections import OrderedDict
 from shutil import copyfile
+import threading
+import weakref
 import numpy as np
-import time
-from qtpy import QtCore
 from . import default_config_dir, user_config_dir
 from .pyrpl_utils import time
 
@@ -31,45 +37,159 @@ logger = logging.getLogger(name=__name__)
 
 class UnexpectedSaveError(RuntimeError):
     pass
-# the config file is read through a yaml interface. The preferred one is
-# ruamel.yaml, since it allows to preserve comments and whitespace in the
-# config file through roundtrips (the config file is rewritten every time a
-# parameter is changed). If ruamel.yaml is not installed, the program will
-# issue a warning and use pyyaml (=yaml= instead). Comments are lost in this
-#  case.
+
+
+# mappings loaded from config files must preserve the order of their keys.
+# From python 3.7 on, the built-in dict does so and is implemented in C with
+# much lower overhead per key than OrderedDict.
+if sys.version_info >= (3, 7):
+    _ordered_dict = dict
+else:
+    _ordered_dict = OrderedDict
+
+
+# numpy arrays with at least this number of elements are stored in config
+# files as base64-encoded .npy data, which is written and parsed much faster
+# than a yaml list with one node per element. Smaller arrays remain
+# human-readable lists.
+_NDARRAY_BLOB_SIZE = 1000
+_NDARRAY_TAG = u'!ndarray'
+
+
+def _represent_ndarray(dumper, array):
+    """ yaml representer for arrays stored as .npy data """
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    blob = base64.encodebytes(buffer.getvalue()).decode('ascii')
+    return dumper.represent_scalar(_NDARRAY_TAG, blob, style='|')
+
+
+def _construct_ndarray(loader, node):
+    """ yaml constructor for arrays stored as .npy data """
+    blob = loader.construct_scalar(node)
+    buffer = io.BytesIO(base64.decodebytes(blob.encode('ascii')))
+    return np.load(buffer, allow_pickle=False)
+
+
+def _to_native(obj):
+    """
+    returns obj with numpy scalars and arrays converted to python types and
+    complex numbers converted to strings, such that the yaml dumpers need no
+    python-level representers for them. Containers are only copied if some
+    of their elements or keys had to be converted. Tuples are converted to
+    lists, which is how the safe dumpers write them anyway. Large arrays are
+    only converted to plain numpy arrays, see _NDARRAY_BLOB_SIZE.
+    """
+    if isinstance(obj, dict):
+        items = None
+        for i, (k, v) in enumerate(obj.items()):
+            nk = _to_native(k) if isinstance(k, (np.generic, complex)) else k
+            nv = _to_native(v)
+            if items is None and (nk is not k or nv is not v):
+                # first converted item, keep the order of the keys
+                items = list(obj.items())[:i]
+            if items is not None:
+                items.append((nk, nv))
+        if items is None:
+            return obj
+        native = copy.copy(obj)
+        native.clear()
+        native.update(items)
+        return native
+    elif isinstance(obj, tuple):
+        return [_to_native(v) for v in obj]
+    elif isinstance(obj, list):
+        native = None
+        for i, v in enumerate(obj):
+            nv = _to_native(v)
+            if nv is not v:
+                if native is None:
+                    native = copy.copy(obj)
+                native[i] = nv
+        return obj if native is None else native
+    elif isinstance(obj, np.ndarray):
+        if obj.size >= _NDARRAY_BLOB_SIZE and not obj.dtype.hasobject:
+            return np.asarray(obj)
+        return _to_native(obj.tolist())
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, complex):
+        return str(obj)
+    return obj
+
+
+def _json_exact(obj):
+    """
+    returns False if json would silently alter obj, i.e. if obj contains
+    tuples or mappings with non-string keys. Types that json cannot
+    represent at all make json.dumps raise a TypeError instead.
+    """
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if not isinstance(k, str) or not _json_exact(v):
+                return False
+    elif isinstance(obj, list):
+        for v in obj:
+            if not _json_exact(v):
+                return False
+    elif isinstance(obj, tuple):
+        return False
+    return True
+
+# the config file is read through a yaml interface, either ruamel.yaml or
+# pyyaml (=yaml=) if ruamel.yaml is not installed. For speed, whole config
+# files are loaded with the (C-accelerated) safe loader into plain dicts
+# with both interfaces. Since the config file is rewritten every time a
+# parameter is changed, comments and whitespace in the config file are no
+# longer preserved through round trips, not even with ruamel.yaml. Only yml
+# snippets passed to MemoryBranch._set_yml go through the round-trip loader
+# load_rt.
 try:
     raise  # disables ruamel support
 
     import ruamel.yaml
     #ruamel.yaml.add_implicit_resolver()
-    ruamel.yaml.RoundTripDumper.add_representer(np.float64,
-                lambda dumper, data: dumper.represent_float(float(data)))
-    ruamel.yaml.RoundTripDumper.add_representer(complex,
-                lambda dumper, data: dumper.represent_str(str(data)))
-    ruamel.yaml.RoundTripDumper.add_representer(np.complex128,
-                lambda dumper, data: dumper.represent_str(str(data)))
     ruamel.yaml.RoundTripDumper.add_representer(np.ndarray,
-                lambda dumper, data: dumper.represent_list(list(data)))
+                                                _represent_ndarray)
+    ruamel.yaml.RoundTripLoader.add_constructor(_NDARRAY_TAG,
+                                                _construct_ndarray)
 
     #http://stackoverflow.com/questions/13518819/avoid-references-in-pyyaml
     #ruamel.yaml.RoundTripDumper.ignore_aliases = lambda *args: True
+    # the round-trip loader preserves comments, but builds a CommentedMap
+    # per node and has no C implementation. The safe loader below wraps
+    # libyaml and is used wherever comments need not be preserved.
+    _safe_yaml = ruamel.yaml.YAML(typ='safe', pure=False)
+    _safe_yaml.constructor.add_constructor(_NDARRAY_TAG, _construct_ndarray)
     def load(f):
+        return _safe_yaml.load(f)
+    def load_rt(f):
         return ruamel.yaml.load(f, ruamel.yaml.RoundTripLoader)
     def save(data, stream=None):
-        return ruamel.yaml.dump(data, stream=stream,
+        return ruamel.yaml.dump(_to_native(data), stream=stream,
                                 Dumper=ruamel.yaml.RoundTripDumper,
-                                default_flow_style=False)
+                                default_flow_style=False,
+                                encoding='utf-8')
 except:
-    logger.debug("ruamel.yaml could not be imported. Using yaml instead. "
-                 "Comments in config files will be lost.")
+    logger.debug("ruamel.yaml could not be imported. Using yaml instead.")
     import yaml
+    # prefer the libyaml-based C implementations, which parse and emit
+    # config files many times faster than the pure-python ones
+    try:
+        _SafeLoader, _SafeDumper = yaml.CSafeLoader, yaml.CSafeDumper
+    except AttributeError:
+        logger.warning("PyYAML was built without libyaml support. Loading "
+                       "and saving config files will be slow. Install "
+                       "libyaml (e.g. libyaml-dev) and reinstall PyYAML to "
+                       "speed this up.")
+        _SafeLoader, _SafeDumper = yaml.SafeLoader, yaml.SafeDumper
 
     # see http://stackoverflow.com/questions/13518819/avoid-references-in-pyyaml
     #yaml.Dumper.ignore_aliases = lambda *args: True # NEVER TESTED
 
     # ordered load and dump for yaml files. From
     # http://stackoverflow.com/questions/5121931/in-python-how-can-you-load-yaml-mappings-as-ordereddicts
-    def load(stream, Loader=yaml.SafeLoader, object_pairs_hook=OrderedDict):
+    def load(stream, Loader=_SafeLoader, object_pairs_hook=_ordered_dict):
         class OrderedLoader(Loader):
             pass
         def construct_mapping(loader, node):
@@ -78,8 +198,9 @@ except:
         OrderedLoader.add_constructor(
             yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
             construct_mapping)
+        OrderedLoader.add_constructor(_NDARRAY_TAG, _construct_ndarray)
         return yaml.load(stream, OrderedLoader)
-    def save(data, stream=None, Dumper=yaml.SafeDumper,
+    def save(data, stream=None, Dumper=_SafeDumper,
              default_flow_style=False,
              encoding='utf-8',
              **kwds):
@@ -90,14 +211,11 @@ except:
                 yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
                 data.items())
         OrderedDumper.add_representer(OrderedDict, _dict_representer)
-        OrderedDumper.add_representer(np.float64,
-                    lambda dumper, data: dumper.represent_float(float(data)))
-        OrderedDumper.add_representer(complex,
-                    lambda dumper, data: dumper.represent_str(str(data)))
-        OrderedDumper.add_representer(np.complex128,
-                    lambda dumper, data: dumper.represent_str(str(data)))
-        OrderedDumper.add_representer(np.ndarray,
-                    lambda dumper, data: dumper.represent_list(list(data)))
+        # do not sort the keys of (ordered) built-in dicts
+        OrderedDumper.add_representer(_ordered_dict, _dict_representer)
+        OrderedDumper.add_representer(np.ndarray, _represent_ndarray)
+        # numpy types and complex numbers are converted beforehand
+        data = _to_native(data)
         # I added the following two lines to make pyrpl compatible with pyinstruments. In principle they can be erased
         if isinstance(data, dict) and not isinstance(data, OrderedDict):
             data = OrderedDict(data)
@@ -108,15 +226,69 @@ except:
                          encoding=encoding,
                          **kwds)
 
+    # comments cannot be preserved by pyyaml
+    load_rt = load
+
     # usage example:
-    # load(stream, yaml.SafeLoader)
-    # save(data, stream=f, Dumper=yaml.SafeDumper)
+    # load(stream, yaml.CSafeLoader)
+    # save(data, stream=f, Dumper=yaml.CSafeDumper)
 
 
 def isbranch(obj):
     return isinstance(obj, dict) or isinstance(obj, list)
 
 
+# names of the files in the config directories, such that config files can
+# be located without probing the file system for each candidate. Maps each
+# directory to its modification time at listing and the set of its names.
+_config_index = dict()
+
+# file names are compared in the case convention of the file system.
+# os.path.normcase does not fold case on macOS, whose default file system
+# is case-insensitive nevertheless.
+if sys.platform == 'darwin':
+    def _normcase(f):
+        return f.lower()
+else:
+    _normcase = os.path.normcase
+
+
+def _list_config_dir(path):
+    """
+    lists the config directory path and stores the result in _config_index
+    """
+    # stat before listing, such that changes during the listing are noticed
+    mtime = os.stat(path).st_mtime
+    names = set(_normcase(f) for f in os.listdir(path))
+    _config_index[path] = (mtime, names)
+    return names
+
+
+def _isfile_in_config_dir(path, f):
+    """
+    same as os.path.isfile(os.path.join(path, f)) for a config directory,
+    but based on a cached listing of the directory that is only refreshed
+    if f is not found in it and the directory has changed since
+    """
+    f = _normcase(f)
+    try:
+        if path not in _config_index:
+            return f in _list_config_dir(path)
+        mtime, names = _config_index[path]
+        if f not in names and os.stat(path).st_mtime != mtime:
+            names = _list_config_dir(path)
+    except OSError:
+        return False
+    return f in names
+
+
+def _add_to_config_index(filename):
+    """ records a file created by pyrpl in the listing of its directory """
+    p, f = os.path.split(filename)
+    if p in _config_index:
+        _config_index[p][1].add(_normcase(f))
+
+
 # two functions to locate config files
 def _get_filename(filename=None):
     """ finds the correct path and name of a config file """
@@ -130,7 +302,10 @@ def _get_filename(filename=None):
     p, f = os.path.split(filename)
     for path in [p, user_config_dir, default_config_dir]:
         file = os.path.join(path, f)
-        if os.path.isfile(file):
+        if path in (user_config_dir, default_config_dir):
+            if _isfile_in_config_dir(path, f):
+                return file
+        elif os.path.isfile(file):
             return file
     # file not existing, place it in user_config_dir
     return os.path.join(user_config_dir, f)
@@ -142,14 +317,21 @@ def get_config_file(filename=None, source=None):
     if filename is None:
         return filename
     # try to locate the file
-    filename = _get_filename(filename)
-    if os.path.isfile(filename):  # found a file
+    name, filename = filename, _get_filename(filename)
+    p, f = os.path.split(filename)
+    if p in _config_index and _normcase(f) in _config_index[p][1] \
+            and not os.path.isfile(filename):
+        # the file was removed since the config directory was listed
+        _config_index.pop(p)
+        filename = _get_filename(name)
         p, f = os.path.split(filename)
+    if os.path.isfile(filename):  # found a file
         if p == default_config_dir:
             # check whether path is default_config_dir and make a copy in
             # user_config_dir in order to not alter original files
             dest = os.path.join(user_config_dir, f)
             copyfile(filename, dest)
+            _add_to_config_index(dest)
             return dest
         else:
             return filename
@@ -159,10 +341,12 @@ def get_config_file(filename=None, source=None):
         if os.path.isfile(source):  # success - copy the source
             logger.debug("File " + filename + " not found. New file created from source '%s'. "%source)
             copyfile(source,filename)
+            _add_to_config_index(filename)
             return filename
     # still not returned -> create empty file
     with open(filename, mode="w"):
         pass
+    _add_to_config_index(filename)
     logger.debug("File " + filename + " not found. New file created. ")
     return filename
 
@@ -217,32 +401,58 @@ class MemoryBranch(object):
     If a subbranch or a value is requested but does not exist in the current MemoryTree, a KeyError is raised.
     """
 
+    # config file entries are not stored as instance attributes, which
+    # makes branches light-weight objects
+    __slots__ = ('_parent', '_branch', '__root', '__fullbranchname',
+                 '__data', '__data_version', '__weakref__')
+
     def __init__(self, parent, branch):
         self._parent = parent
         self._branch = branch
-        self._update_instance_dict()
+        self._init_hierarchy()
+        # the data of the branch is looked up upon first access
+        self.__data_version = -1
 
-    def _update_instance_dict(self):
-        data = self._data
-        if isinstance(data, dict):
-            for k in self.__dict__.keys():
-                if k not in data and not k.startswith('_'):
-                    self.__dict__.pop(k)
-            for k in data.keys():
-                # write None since this is only a
-                # placeholder (__getattribute__ is overwritten below)
-                self.__dict__[k] = None
+    def _init_hierarchy(self):
+        """
+        stores the root of the tree and the full name of the branch, such
+        that they need not be searched for upon each access
+        """
+        parent = self._parent
+        if parent is self:  # the MemoryTree itself
+            self.__root = self
+            self.__fullbranchname = self._branch
+        elif parent._parent is parent:  # first level below the MemoryTree
+            self.__root = parent
+            self.__fullbranchname = self._branch
+        else:
+            self.__root = parent._root
+            self.__fullbranchname = "%s.%s" % (parent._fullbranchname,
+                                               self._branch)
+
+    def __dir__(self):
+        """ the keys of the branch are listed for auto-completion """
+        completion_keys = [k for k in self._keys() if isinstance(k, str)]
+        return completion_keys + super(MemoryBranch, self).__dir__()
 
     @property
     def _data(self):
-        """ The raw data (OrderedDict) or Mapping of the branch """
-        return self._parent._data[self._branch]
+        """ The raw data (dict, OrderedDict) or Mapping of the branch """
+        # the lookup through all parents is only repeated if the tree has
+        # been modified since
+        version = self.__root._version
+        if self.__data_version != version:
+            self.__data = self._parent._data[self._branch]
+            self.__data_version = version
+        return self.__data
 
     @_data.setter
     def _data(self, value):
         logger.warning("You are directly modifying the data of MemoryBranch"
                        " %s to %s.", self._fullbranchname, str(value))
-        self._parent._data[self._branch] = value
+        with self._root._lock:
+            self._root._version += 1
+            self._parent._data[self._branch] = value
 
     def _keys(self):
         if isinstance(self._data, list):
@@ -251,13 +461,13 @@ class MemoryBranch(object):
             return self._data.keys()
 
     def _update(self, new_dict):
-        if isinstance(self._data, list):
+        data = self._data
+        if isinstance(data, list):
             raise NotImplementedError
-        self._data.update(new_dict)
+        with self._root._lock:
+            self._root._version += 1
+            data.update(new_dict)
         self._save()
-        # keep auto_completion up to date
-        for k in new_dict:
-            self.__dict__[k] = None
 
     def __getattribute__(self, name):
         """ implements the dot notation.
@@ -276,14 +486,32 @@ class MemoryBranch(object):
         file.
         """
         self._reload()
+        return self._getitem(item)
+
+    def _getitem(self, item):
+        """
+        same as __getitem__, but without calling _reload, such that a dotted
+        item such as 'a.b.c' checks for changes of the config file only once
+        """
         # if a subbranch is requested, iterate through the hierarchy
         if isinstance(item, str) and '.' in item:
             item, subitem = item.split('.', 1)
-            return self[item][subitem]
+            attribute = self._getitem(item)
+            if isinstance(attribute, MemoryBranch):
+                return attribute._getitem(subitem)
+            else:
+                return attribute[subitem]
         else:  # otherwise just return what we can find
             attribute = self._data[item]  # read from the data dict
             if isbranch(attribute):  # if the object can be expressed as a branch, do so
-                return MemoryBranch(self, item)
+                # reuse the branch object if it still exists
+                key = (id(self), item)
+                branch_cache = self.__root._branch_cache
+                branch = branch_cache.get(key)
+                if branch is None:
+                    branch = MemoryBranch(self, item)
+                    branch_cache[key] = branch
+                return branch
             else:  # otherwise return whatever we found in the data dict
                 return attribute
 
@@ -324,32 +552,45 @@ class MemoryBranch(object):
             logger.warning("Issuing call to MemoryTree._save after %s.%s=%s",
                            self._branch, item, value)
         self._save()
-        # update the __dict__ for autocompletion
-        self.__dict__[item] = None
 
     def _set_data(self, item, value):
         """
         helper function to manage setting list entries that do not exist
         """
-        if isinstance(self._data, list) and item == len(self._data):
-            self._data.append(value)
-        else:
-            # trivial case: _data is dict or item within list length
-            # and we can simply set the entry
-            self._data[item] = value
+        with self._root._lock:
+            self._root._version += 1
+            if isinstance(self._data, list) and item == len(self._data):
+                self._data.append(value)
+            else:
+                # trivial case: _data is dict or item within list length
+                # and we can simply set the entry
+                self._data[item] = value
 
     def _pop(self, name):
         """
         remove an item from the branch
         """
-        value = self._data.pop(name)
-        if name in self.__dict__.keys():
-            self.__dict__.pop(name)
+        with self._root._lock:
+            self._root._version += 1
+            value = self._data.pop(name)
+        self._root._branch_cache.pop((id(self), name), None)
         self._save()
         return value
 
     def _rename(self, name):
         self._parent[name] = self._parent._pop(self._branch)
+        self._branch = name
+        self._init_hierarchy()
+        self.__data_version = -1
+        self._root._branch_cache[(id(self._parent), name)] = self
+        # cached subbranches must not keep the former full branch name
+        parents = [self]
+        while parents:
+            parent = parents.pop()
+            for branch in list(self._root._branch_cache.values()):
+                if branch._parent is parent and branch is not parent:
+                    branch._init_hierarchy()
+                    parents.append(branch)
         self._save()
 
     def _get_or_create(self, name):
@@ -362,7 +603,9 @@ class MemoryBranch(object):
         if isinstance(name, int):
             if name == 0 and len(self) == 0:
                 # instantiate a new list - odd way because we must
-                self._parent._data[self._branch] = []
+                with self._root._lock:
+                    self._root._version += 1
+                    self._parent._data[self._branch] = []
             # if index <= len, creation is done automatically if needed
             # otherwise an error is raised
             if name >= len(self):
@@ -391,27 +634,19 @@ class MemoryBranch(object):
         """
         returns the parent highest in hierarchy (the MemoryTree object)
         """
-        parent = self
-        while parent != parent._parent:
-            parent = parent._parent
-        return parent
+        return self.__root
 
     @property
     def _fullbranchname(self):
-        parent = self._parent
-        branchname = self._branch
-        while parent != parent._parent:
-            branchname = parent._branch + '.' + branchname
-            parent = parent._parent
-        return branchname
+        return self.__fullbranchname
 
     def _reload(self):
         """ reload data from file"""
-        self._parent._reload()
+        self.__root._reload()
 
     def _save(self):
         """ write data to file"""
-        self._parent._save()
+        self.__root._save()
 
     def _get_yml(self, data=None):
         """
@@ -424,8 +659,10 @@ class MemoryBranch(object):
         :param yml_content: sets the branch to yml_content
         :return: None
         """
-        branch = load(yml_content)
-        self._parent._data[self._branch] = branch
+        branch = load_rt(yml_content)
+        with self._root._lock:
+            self._root._version += 1
+            self._parent._data[self._branch] = branch
         self._save()
 
     def __len__(self):
@@ -493,20 +730,35 @@ class MemoryTree(MemoryBranch):
     def __init__(self, filename=None, source=None, _loadsavedeadtime=3.0):
         # never reload or save more frequently than _loadsavedeadtime because
         # this is the principal cause of slowing down the code (typ. 30-200 ms)
-        # for immediate saving, call _save_now, for immediate loading _load_now
+        # for immediate saving, call _write_to_file, for immediate loading _load
         self._loadsavedeadtime = _loadsavedeadtime
         # first, make sure filename exists
         self._filename = get_config_file(filename, source)
         if filename is None:
             # to simulate a config file, only store data in memory
             self._filename = filename
-            self._data = OrderedDict()
+            self._data = _ordered_dict()
+            # file changes never need to be checked for
+            self._next_reload_check = float('inf')
         self._lastsave = time()
-        # create a timer to postpone to frequent savings
-        self._savetimer = QtCore.QTimer()
-        self._savetimer.setInterval(self._loadsavedeadtime*1000)
-        self._savetimer.setSingleShot(True)
-        self._savetimer.timeout.connect(self._write_to_file)
+        # True if the tree has changed since the last write to file
+        self._dirty = False
+        # hash of the last content written to file
+        self._content_hash = None
+        # a backup is made before the first write to the file
+        self._backed_up = False
+        # timer to postpone too frequent savings, only exists while a
+        # save is pending
+        self._savetimer = None
+        # the timer writes from another thread, during which the data must
+        # not be modified
+        self._lock = threading.RLock()
+        # incremented upon each modification of the tree structure, such
+        # that branches know when to look up their data again
+        self._version = 0
+        # subbranch objects indexed by (id(parent), branch) are reused as
+        # long as they exist
+        self._branch_cache = weakref.WeakValueDictionary()
         self._load()
 
         self._save_counter = 0 # cntr for unittest and debug purposes
@@ -521,48 +773,126 @@ class MemoryTree(MemoryBranch):
         """ makes a temporary file to ensure modification of config file is atomic (double-buffering like operation...)"""
         return self._filename + '.tmp'
 
+    @property
+    def _cache_filename(self):
+        """ json copy of the parsed config file, which loads much faster """
+        return self._filename + '.cache.json'
+
+    def _load_cache(self, digest):
+        """
+        returns the data stored in the json cache if the cache was made
+        from the config file content with the sha1 digest digest, None
+        otherwise
+        """
+        try:
+            with open(self._cache_filename) as f:
+                cache = json.load(f, object_pairs_hook=_ordered_dict)
+            if cache['__yaml_sha1__'] == digest:
+                return cache['data']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass  # missing or corrupt cache file
+        return None
+
+    def _save_cache(self, digest):
+        """
+        writes the data to the json cache, together with the sha1 digest of
+        the config file content it was made from. The modification time of
+        the file is not sufficient to detect outdated caches, since it has a
+        resolution of up to 2 s on some file systems.
+        """
+        # same types as obtained by reloading the yml file. Large arrays
+        # remain numpy arrays and raise a TypeError below.
+        data = _to_native(self._data)
+        try:
+            # json silently converts non-string keys, tuples etc.
+            if not _json_exact(data):
+                raise ValueError("Data cannot be represented in json.")
+            content = json.dumps(OrderedDict([
+                ('__yaml_sha1__', digest),
+                ('data', data)]))
+        except (TypeError, ValueError) as e:
+            logger.debug("No json cache is used for config file %s: %s",
+                         self._filename, e)
+            # an outdated cache must not survive
+            try:
+                if os.path.exists(self._cache_filename):
+                    os.remove(self._cache_filename)
+            except (IOError, OSError) as e:
+                logger.debug("Could not remove json cache of config file "
+                             "%s: %s", self._filename, e)
+            return
+        # write to a temporary file first, such that a concurrent _load
+        # never reads a partially written cache
+        tmp_filename = self._cache_filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as f:
+                f.write(content)
+            os.replace(tmp_filename, self._cache_filename)
+        except (IOError, OSError) as e:
+            logger.debug("Could not write json cache of config file %s: %s",
+                         self._filename, e)
+            try:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+            except (IOError, OSError):
+                pass
+
     def _load(self):
         """ loads data from file """
         if self._filename is None:
             # if no file is used, just ignore this call
             return
         logger.debug("Loading config file %s", self._filename)
-        # read file from disc
-        with open(self._filename) as f:
-            self._data = load(f)
-        # store the modification time of this file version
-        self._mtime = os.path.getmtime(self._filename)
+        with self._lock:
+            # store the modification time of this file version. The lock
+            # ensures that no write of this tree is in progress meanwhile.
+            self._mtime = os.stat(self._filename).st_mtime
+            self._version += 1
+            self._branch_cache.clear()
+            # read file from disc. Hashing the content costs little
+            # compared to parsing it.
+            with open(self._filename, 'rb') as f:
+                content = f.read()
+            digest = hashlib.sha1(content).hexdigest()
+            # the json cache is preferred if it is up to date
+            self._data = self._load_cache(digest)
+            if self._data is None:
+                # decoded the same way as by open() in text mode
+                self._data = load(io.TextIOWrapper(io.BytesIO(content)))
+                # empty file gives _data=None
+                if self._data is None:
+                    self._data = _ordered_dict()
+                self._save_cache(digest)
         # make sure that reload timeout starts from this moment
         self._lastreload = time()
-        # empty file gives _data=None
-        if self._data is None:
-            self._data = OrderedDict()
-        # update dict of the MemoryTree object
-        to_remove = []
-        # remove all obsolete entries
-        for name in self.__dict__:
-            if not name.startswith('_') and name not in self._data:
-                to_remove.append(name)
-        for name in to_remove:
-            self.__dict__.pop(name)
-        # insert the branches into the object __dict__ for auto-completion
-        self.__dict__.update(self._data)
+        self._next_reload_check = self._lastreload + self._loadsavedeadtime
+        # the tree is identical to the file now, but the hash of the last
+        # written content no longer describes the file
+        self._dirty = False
+        self._content_hash = None
 
     def _reload(self):
         """
         reloads data from file if file has changed recently
         """
-        # first check if a reload was not performed recently (speed up reasons)
-        if self._filename is None:
+        # first check if a reload was not performed recently (speed up
+        # reasons). This is called upon every access to the tree, so the
+        # check is a single comparison against the precomputed deadline
+        # (infinite if no file is used).
+        now = time()
+        if now <= self._next_reload_check:
             return
-        # check whether reload timeout has expired
-        if time() > self._lastreload + self._loadsavedeadtime:
-            # prepare next timeout
-            self._lastreload = time()
-            logger.debug("Checking change time of config file...")
-            if self._mtime != os.path.getmtime(self._filename):
+        # prepare next timeout
+        self._lastreload = now
+        self._next_reload_check = now + self._loadsavedeadtime
+        logger.debug("Checking change time of config file...")
+        # a write in progress in the save timer thread has not yet updated
+        # self._mtime, so the comparison must wait for it
+        with self._lock:
+            mtime = os.stat(self._filename).st_mtime
+            if self._mtime != mtime:
                 logger.debug("Loading because mtime %s != filetime %s",
-                             self._mtime)
+                             self._mtime, mtime)
                 self._load()
             else:
                 logger.debug("... no reloading required")
@@ -571,40 +901,80 @@ class MemoryTree(MemoryBranch):
         """
         Immmediately writes the content of the memory tree to file
         """
-        # stop save timer
-        if hasattr(self, '_savetimer') and self._savetimer.isActive():
-            self._savetimer.stop()
-        self._lastsave = time()
-        self._write_to_file_counter += 1
-        logger.debug("Saving config file %s", self._filename)
+        with self._lock:
+            # stop save timer
+            if self._savetimer is not None:
+                self._savetimer.cancel()
+                self._savetimer = None
+            self._lastsave = time()
+            self._write_to_file_counter += 1
+            logger.debug("Saving config file %s", self._filename)
+            if self._filename is None:
+                # skip writing to file if no filename was selected
+                return
+            elif not self._dirty:
+                logger.debug("... no changes since last save.")
+                return
+            else:
+                content = save(self._data)
+                content_hash = hash(content)
+                # a single stat tells whether the file still exists and
+                # whether it has been modified by someone else
+                try:
+                    stat = os.stat(self._filename)
+                except OSError:  # file has been removed meanwhile
+                    stat = None
+                if stat is None or stat.st_mtime != self._mtime:
+                    logger.warning("Config file has recently been changed on your " +
+                                   "harddisk. These changes might have been " +
+                                   "overwritten now.")
+                elif content_hash == self._content_hash:
+                    # setting e.g. a value identical to the current one
+                    logger.debug("... content identical to file.")
+                    self._dirty = False
+                    return
+                # we must be sure that overwriting config file never destroys existing data.
+                # security 1: backup of the file as it was before the first
+                # write of this session
+                if not self._backed_up and stat is not None:
+                    self._backup()
+                # security 2: atomic writing such as shown in
+                # http://stackoverflow.com/questions/2333872/atomic-writing-to-file-with-python:
+                try:
+                    # content is already utf-8 encoded by the yaml emitter and
+                    # can be handed to the OS without another buffering layer
+                    fd = os.open(self._buffer_filename,
+                                 os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                                 | getattr(os, 'O_BINARY', 0), 0o666)
+                    try:
+                        view = memoryview(content)
+                        while view:
+                            view = view[os.write(fd, view):]
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                    # atomic on posix and windows
+                    os.replace(self._buffer_filename, self._filename)
+                except:
+                    if os.path.exists(self._buffer_filename):
+                        os.remove(self._buffer_filename)
+                    logger.error("Error writing to file. The config file was "
+                                 "left unchanged.")
+                    raise
+                self._dirty = False
+                self._content_hash = content_hash
+                # save last modification time of the file
+                self._mtime = os.stat(self._filename).st_mtime
+                self._save_cache(hashlib.sha1(content).hexdigest())
+
+    def _backup(self):
+        """
+        copies the config file to a .bak file
+        """
         if self._filename is None:
-            # skip writing to file if no filename was selected
             return
-        else:
-            if self._mtime != os.path.getmtime(self._filename):
-                logger.warning("Config file has recently been changed on your " +
-                               "harddisk. These changes might have been " +
-                               "overwritten now.")
-            # we must be sure that overwriting config file never destroys existing data.
-            # security 1: backup with copyfile above
-            copyfile(self._filename,
-                     self._filename + ".bak")  # maybe this line is obsolete (see below)
-            # security 2: atomic writing such as shown in
-            # http://stackoverflow.com/questions/2333872/atomic-writing-to-file-with-python:
-            try:
-                f = open(self._buffer_filename, mode='w')
-                save(self._data, stream=f)
-                f.flush()
-                os.fsync(f.fileno())
-                f.close()
-                os.unlink(self._filename)
-                os.rename(self._buffer_filename, self._filename)
-            except:
-                copyfile(self._filename + ".bak", self._filename)
-                logger.error("Error writing to file. Backup version was restored.")
-                raise
-            # save last modification time of the file
-            self._mtime = os.path.getmtime(self._filename)
+        copyfile(self._filename, self._filename + ".bak")
+        self._backed_up = True
 
     def _save(self, deadtime=None):
         """
@@ -620,6 +990,10 @@ class MemoryTree(MemoryBranch):
             logger.warning("Save counter has just been increased to %d.",
                            self._save_counter)
         self._save_counter += 1  # for unittest and debug purposes
+        self._dirty = True
+        if self._filename is None:
+            # nothing to write, so no timer thread needs to be launched
+            return
         if deadtime is None:
             deadtime = self._loadsavedeadtime
         # now write current tree structure and data to file
@@ -627,8 +1001,12 @@ class MemoryTree(MemoryBranch):
             self._write_to_file()
         else:
             # make sure saving will eventually occur by launching a timer
-            if not self._savetimer.isActive():
-                self._savetimer.start()
+            with self._lock:
+                if self._savetimer is None:
+                    self._savetimer = threading.Timer(self._loadsavedeadtime,
+                                                      self._write_to_file)
+                    self._savetimer.daemon = True
+                    self._savetimer.start()
 
     @property
     def _filename_stripped(self):
@@ -24,15 +24,17 @@ class TestPyrpl(object):
     def erase_temp_file(self):
         tmp_conf = os.path.join(user_config_dir,
                      self.tmp_config_file)
-        if os.path.isfile(tmp_conf):
-            try:
-                os.remove(tmp_conf)
-            # sometimes, an earlier test delete file between exists and
-            # remove calls, this gives a WindowsError
-            except WindowsError:
-                pass
-        while os.path.exists(tmp_conf):
-            pass  # make sure the file is really gone before proceeding further
+        # the json cache of the config file must be removed as well
+        for filename in (tmp_conf, tmp_conf + '.cache.json'):
+            if os.path.isfile(filename):
+                try:
+                    os.remove(filename)
+                # sometimes, an earlier test delete file between exists and
+                # remove calls, this gives a WindowsError
+                except WindowsError:
+                    pass
+            while os.path.exists(filename):
+                pass  # make sure the file is really gone before proceeding further
 
     @classmethod
     def setUpAll(cls):
@@ -1,10 +1,20 @@
 import logging
 logger = logging.getLogger(name=__name__)
 import os
-from ..memory import MemoryTree, MemoryBranch
+import numpy as np
+from ..memory import MemoryTree, MemoryBranch, _to_native, get_config_file
 from .. import *
+from .. import default_config_dir, user_config_dir
 from ..async_utils import sleep
 
+
+def remove_config(tree):
+    """ removes the config file of tree together with its json cache """
+    for filename in (tree._filename, tree._cache_filename):
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
 class TestMemory(object):
     def test_load(self):
         mt = MemoryTree(filename='test', source='nosetests_source')
@@ -19,10 +29,10 @@ class TestMemory(object):
         mt = MemoryTree('test')
         assert mt.pyrpl._data is not None
         mt = MemoryTree('test')
-        os.remove(mt._filename)
+        remove_config(mt)
         mt = MemoryTree('test')
         assert len(mt._keys()) == 0
-        os.remove(mt._filename)
+        remove_config(mt)
 
     def test_usage(self):
         """ tests for the typical use cases of memorytree """
@@ -68,7 +78,192 @@ class TestMemory(object):
             # save and delete file
             m._write_to_file()
             if m._filename is not None:
-                os.remove(m._filename)
+                remove_config(m)
+
+    def test_branch_names(self):
+        m = MemoryTree()
+        m.a = dict(b=dict(c=[dict(d=1)]))
+        assert m._root is m
+        assert m.a.b.c[0]._root is m
+        assert m.a.b.c[0]._fullbranchname == 'a.b.c.0'
+        b = m.a.b
+        c = m.a.b.c[0]
+        b._rename('e')
+        assert b._fullbranchname == 'a.e'
+        assert m.a.e.c[0] is c
+        assert c._fullbranchname == 'a.e.c.0'
+        assert b.c[0].d == 1
+        assert 'b' not in m.a
+
+    def test_branch_reuse(self):
+        m = MemoryTree()
+        m.a = dict(b=dict(c=1))
+        b = m.a.b
+        assert m.a.b is b
+        assert m['a.b'] is b
+        m.a.b = dict(c=2)
+        assert b.c == 2
+        m.a._pop('b')
+        m.a.b = dict(c=3)
+        assert m.a.b is not b
+
+    def test_completion_keys(self):
+        m = MemoryTree()
+        m.a = dict(b=1)
+        assert 'b' in dir(m.a)
+        assert 'a' in dir(m)
+        m.a._pop('b')
+        assert 'b' not in dir(m.a)
+        m.a.c = 2
+        assert 'c' in dir(m.a)
+
+    def test_removed_config_file(self):
+        name = 'nosetests_source_dummy_module'
+        user_file = os.path.join(user_config_dir, name + '.yml')
+        with open(os.path.join(default_config_dir, name + '.yml')) as f:
+            default_content = f.read()
+        # a user copy is made from the default config file and indexed
+        assert get_config_file(name) == user_file
+        assert get_config_file(name) == user_file
+        with open(user_file, 'w') as f:
+            f.write("a: 1\n")
+        # once the user copy is removed, the default file is copied again
+        os.remove(user_file)
+        assert get_config_file(name) == user_file
+        with open(user_file) as f:
+            assert f.read() == default_content
+        os.remove(user_file)
+        # files created by someone else after the listing are found as well
+        sleep(0.05)
+        other_file = os.path.join(user_config_dir, 'test_other.yml')
+        with open(other_file, 'w') as f:
+            f.write("a: 1\n")
+        assert get_config_file('test_other') == other_file
+        assert MemoryTree('test_other').a == 1
+        remove_config(MemoryTree('test_other'))
+
+    def test_json_cache(self):
+        m = MemoryTree('test_cache')
+        m.a = dict(b=[1, 2.5, 'c'])
+        m._write_to_file()
+        assert os.path.isfile(m._cache_filename)
+        assert not os.path.exists(m._cache_filename + '.tmp')
+        m2 = MemoryTree(m._filename)
+        assert m2.a.b[1] == 2.5
+        # non-string keys cannot be stored in json
+        m.d = {1: 2}
+        m._write_to_file()
+        assert not os.path.isfile(m._cache_filename)
+        m3 = MemoryTree(m._filename)
+        assert m3.d[1] == 2
+        m._pop('d')
+        m._write_to_file()
+        assert os.path.isfile(m._cache_filename)
+        # the cache is ignored once the file has been modified externally
+        sleep(0.05)
+        with open(m._filename, 'w') as f:
+            f.write("a: 3\n")
+        m4 = MemoryTree(m._filename)
+        assert m4.a == 3
+        # ... even if neither its size nor its modification time changed
+        stat = os.stat(m._filename)
+        with open(m._filename, 'w') as f:
+            f.write("a: 4\n")
+        os.utime(m._filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert MemoryTree(m._filename).a == 4
+        remove_config(m)
+
+    def test_unchanged_content_not_written(self):
+        m = MemoryTree('test_unchanged', _loadsavedeadtime=0)
+        m.a = 1
+        mtime = os.path.getmtime(m._filename)
+        sleep(0.05)
+        m.a = 1  # same content, file must not be touched
+        m._write_to_file()  # nothing changed
+        assert os.path.getmtime(m._filename) == mtime
+        m.a = 2
+        assert os.path.getmtime(m._filename) != mtime
+        # an external change must not be mistaken for unchanged content
+        m.a = 1
+        sleep(0.05)
+        with open(m._filename, 'w') as f:
+            f.write("a: 2\n")
+        assert m.a == 2
+        m.a = 1
+        assert MemoryTree('test_unchanged').a == 1
+        remove_config(m)
+
+    def test_backup(self):
+        m = MemoryTree('test_backup')
+        with open(m._filename, 'w') as f:
+            f.write("a: 0\n")
+        m = MemoryTree('test_backup', _loadsavedeadtime=0)
+        m.a = 1
+        m.a = 2
+        # the backup holds the file as it was before this session
+        with open(m._filename + '.bak') as f:
+            assert f.read() == "a: 0\n"
+        # a failed write leaves the config file untouched
+        fsync = os.fsync
+        def failing_fsync(fd):
+            raise OSError("disk full")
+        os.fsync = failing_fsync
+        try:
+            m.a = 3
+        except OSError:
+            pass
+        else:
+            assert False, "failed write did not raise"
+        finally:
+            os.fsync = fsync
+        assert not os.path.exists(m._buffer_filename)
+        assert MemoryTree('test_backup').a == 2
+        remove_config(m)
+        os.remove(m._filename + '.bak')
+
+    def test_numpy_types(self):
+        m = MemoryTree('test_numpy_types')
+        m.i = np.int64(3)
+        m.f = np.float32(0.5)
+        m.b = np.bool_(True)
+        m.c = [[1 + 2j, np.complex128(3j)]]
+        m.t = (np.float64(0.5), 1.0)
+        m.d = {'t': (1 + 2j, 3)}
+        m.k = {np.float64(1.0): 1, 2j: 2}
+        m._write_to_file()
+        for i in range(2):  # from json cache, then from yml file
+            m2 = MemoryTree(m._filename)
+            assert m2.i == 3 and type(m2.i) is int
+            assert m2.f == 0.5 and type(m2.f) is float
+            assert m2.b is True
+            assert m2.c[0]._data == ['(1+2j)', '3j']
+            assert m2.t._data == [0.5, 1.0] and type(m2.t[0]) is float
+            assert m2.d.t._data == ['(1+2j)', 3]
+            assert m2.k._data == {1.0: 1, '2j': 2}
+            assert type(list(m2.k._keys())[0]) is float
+            if os.path.exists(m._cache_filename):
+                os.remove(m._cache_filename)
+        remove_config(m)
+        # containers are only copied if some element is converted
+        data = dict(a=[1, 'x'], b=dict(c=2.0))
+        assert _to_native(data) is data
+        data['b']['d'] = np.int64(1)
+        native = _to_native(data)
+        assert native is not data and native['b'] is not data['b']
+        assert native['a'] is data['a']
+        assert type(native['b']['d']) is int
+        assert type(data['b']['d']) is np.int64
+
+    def test_ndarray(self):
+        m = MemoryTree('test_ndarray')
+        m.small = np.arange(3)
+        m.large = np.linspace(0, 1, 5000) + 1j
+        m._write_to_file()
+        m2 = MemoryTree(m._filename)
+        assert m2.small._data == [0, 1, 2]
+        assert isinstance(m2.large, np.ndarray)
+        assert (m2.large == m.large).all()
+        remove_config(m)
 
     def test_two_trees(self):
         """ makes two different memorytree objects that might have conflicts w.r.t. each other.
@@ -100,7 +295,7 @@ class TestMemory(object):
         assert m2.a == 1, m2.a
         sleep(T1 + 0.05)  # some extra time is needed for overhead
         # now changes should have been written to file
-        assert not m1._savetimer.isActive(), m1._savetimer.interval()
+        assert m1._savetimer is None
         assert m1._write_to_file_counter == old_save_to_file + 1, \
             m1._save_counter
         # but m2 will only attempt to reload once m2._loadsavedeadtime has elapsed
@@ -117,7 +312,7 @@ class TestMemory(object):
         # clean up
         m1._write_to_file()
         m2._write_to_file()
-        os.remove(m1._filename)
+        remove_config(m1)
 
     def test_two_trees_nodeadtime(self):
         """ makes two different memorytree objects that might have conflicts w.r.t. each other.
@@ -146,7 +341,7 @@ class TestMemory(object):
         assert m1.a == 2
         assert m1._write_to_file_counter == 6
         assert m2.a == 2, m2.a
-        assert not m1._savetimer.isActive(), m1._savetimer.interval()
+        assert m1._savetimer is None
         assert m1._write_to_file_counter == 6, m1._save_counter
         assert m2.a == 2
         assert m1._write_to_file_counter == 6
@@ -165,4 +360,4 @@ class TestMemory(object):
         # clean up
         m1._write_to_file()
         m2._write_to_file()
-        os.remove(m1._filename)
+        remove_config(m1)